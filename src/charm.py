@@ -4,7 +4,9 @@
 
 """Charm the application."""
 
+import functools
 import logging
+import os
 import ops
 # A standalone module for workload-specific logic (no charming concerns):
 import stork
@@ -18,6 +20,24 @@ from charms.data_platform_libs.v0.data_interfaces import (
 
 logger = logging.getLogger(__name__)
 
+# Hooks that never deliver database events, DB observers are not wired for these.
+# Only the very first hook qualifies: without the observers ops cannot restore
+# deferred DB events and drops them, and e.g. start also runs after a reboot.
+NO_DATABASE_HOOKS = frozenset({"install"})
+
+
+def _parse_endpoints(endpoints: str) -> tuple[str, str] | None:
+    """Split a "host:port" endpoint, returns None unless both parts are usable."""
+    host, _, port = endpoints.partition(":")
+    if not host or host == "None" or not port.isdigit():
+        logger.warning(
+            "charm._parse_endpoints(): Relation data invalid, expected host:port: "
+            "endpoints=%s",
+            endpoints,
+        )
+        return None
+    return host, port
+
 
 class StorkCharm(ops.CharmBase):
     """Charm the application."""
@@ -33,14 +53,26 @@ class StorkCharm(ops.CharmBase):
         # TODO: Consider if the database name should be configurable
         self.database_name = f"{self.app.name.replace('-', '_')}_database"
         # This may also continue more variables, like from the charm config
-        self.database = DatabaseRequires(
-            self, "database", self.database_name
-        )
-
-        framework.observe(self.database.on.database_created, self._on_database_created)
-        framework.observe(self.database.on.endpoints_changed, self._on_database_endpoints_changed)
+        self._database = None
+
+        # Observers must be registered before dispatch, so decide up front
+        # from the hook (e.g. "hooks/install") whether DB events can arrive
+        hook = os.environ.get("JUJU_DISPATCH_PATH", "").rpartition("/")[2]
+        if hook not in NO_DATABASE_HOOKS:
+            database = self.database
+            framework.observe(database.on.database_created, self._on_database_created)
+            framework.observe(database.on.endpoints_changed, self._on_database_endpoints_changed)
         framework.observe(self.on["database"].relation_broken, self._on_relation_broken)
 
+    @property
+    def database(self) -> DatabaseRequires:
+        """The database requirer, constructed on first use."""
+        if self._database is None:
+            self._database = DatabaseRequires(
+                self, "database", self.database_name
+            )
+        return self._database
+
     def _on_install(self, event: ops.InstallEvent):
         """Install the workload on the machine."""
         stork.install()
@@ -56,12 +88,14 @@ class StorkCharm(ops.CharmBase):
             self.unit.set_workload_version(storkversion)
 
         # Database info is required to render the config
-        if self._connection_string is None:
+        if (dbconn := self._connection_string) is None:
             logger.warning("charm._on_config_changed(): Deferring - no DB connection")
             event.defer()
             return
 
-        stork.render_and_reload(self._connection_string)
+        if stork.render_and_reload(dbconn) != 0:
+            logger.warning("charm._on_config_changed(): Deferring - failed to (re)start service")
+            event.defer()
 
     def _on_collect_unit_status(self, event: ops.CollectStatusEvent):
         """This function is run after every other hook"""
@@ -89,9 +123,19 @@ class StorkCharm(ops.CharmBase):
     # First database events observers.
     def _on_database_created(self, event: DatabaseCreatedEvent) -> None:
         """Event triggered when a database was created for this application."""
-        # TODO: Test first if _connection_string is None?? Better: Check result!
-        stork.db_init(self._connection_string)
-        stork.render_and_reload(self._connection_string)
+        if (dbconn := self._connection_string) is None:
+            logger.warning("charm._on_database_created(): No DB connection, data incomplete")
+            return
+
+        # Retry later rather than start the service against a half-initialized database
+        if stork.db_init(dbconn) != 0:
+            logger.warning("charm._on_database_created(): Deferring - database init failed")
+            event.defer()
+            return
+
+        if stork.render_and_reload(dbconn) != 0:
+            logger.warning("charm._on_database_created(): Deferring - failed to (re)start service")
+            event.defer()
 
     def _on_relation_broken(self, event: ops.RelationBrokenEvent) -> None:
         """Event triggered when a database relation is left."""
@@ -107,55 +151,57 @@ class StorkCharm(ops.CharmBase):
     def _on_database_endpoints_changed(self, event: DatabaseEndpointsChangedEvent) -> None:
         """Event triggered when the read/write endpoints of the database change."""
         logger.info(f"database endpoints have been changed to: {event.endpoints}")
-        if self._connection_string is None:
+        if (dbconn := self._connection_string) is None:
             logger.info(f"No DB connection string, error?!")
             return
         else:
-            logger.info(f"DB Connection string is now: {self._connection_string}")
-            stork.render_and_reload(self._connection_string)
-
-    @property
-    def _connection_string(self) -> dict | None:
-        """Returns the PostgreSQL connection string."""
+            logger.info(f"DB Connection string is now: {dbconn}")
+            if stork.render_and_reload(dbconn) != 0:
+                logger.warning("charm._on_database_endpoints_changed(): "
+                    "Deferring - failed to (re)start service")
+                event.defer()
+
+    @functools.cached_property
+    def _connection_string(self) -> stork.DbConn | None:
+        """Returns the PostgreSQL connection parameters.
+
+        The charm instance only lives for one hook, so the relation data is
+        fetched at most once per dispatch.
+        """
         # Check if we have a database relation before we proceed
         if not self.model.relations.get("database"):
             logger.warning("charm._connection_string(): No database related")
             return None
 
-        db_data = list(self.database.fetch_relation_data().values())
-        data = (
-            db_data[0]
-            if db_data
-            else next(data for data in self.database.fetch_relation_data().values())
-        )
+        all_data = self.database.fetch_relation_data()
+        if not all_data:
+            logger.warning("charm._connection_string(): No database relation data")
+            return None
+        data = next(iter(all_data.values()))
 
         username = data.get("username")
         password = data.get("password")
         endpoints = data.get("endpoints")
         database = data.get("database")
-        if None in [username, password, endpoints]:
-            logger.warning((
-                f"charm._connection_string(): Relation data incomplete, values are None: "
-                f"username={username}, password={password}, endpoints={endpoints}"
-            ))
+        if username is None or password is None or endpoints is None or database is None:
+            logger.warning(
+                "charm._connection_string(): Relation data incomplete, values are None: "
+                "username=%s, password set=%s, endpoints=%s, database=%s",
+                username, password is not None, endpoints, database,
+            )
             return None
 
-        host, port = endpoints.split(":")
-        if not host or host == "None":
-            logger.warning((
-                f"charm._connection_string(): Relation data incomplete, values are None: "
-                f"host={host}, port={port}"
-            ))
+        if (parsed := _parse_endpoints(endpoints)) is None:
             return None
-
-        return ({
-            "dbname": database,
-            "dbuser": username,
-            "dbhost": host,
-            "dbpass": password,
-            "dbport": port,
-            "dbopts": "connect_timeout=5 keepalives=1 keepalives_idle=30 keepalives_count=1 tcp_user_timeout=30"
-        })
+        host, port = parsed
+
+        return stork.DbConn(
+            dbname=database,
+            dbuser=username,
+            dbhost=host,
+            dbpass=password,
+            dbport=port,
+        )
 
 
 if __name__ == "__main__":  # pragma: nocover
@@ -6,26 +6,79 @@
 The intention is that this module could be used outside the context of a charm.
 """
 
+import functools
 import logging
+import os
 import subprocess
-
-from charmlibs import apt
-from charms.operator_libs_linux.v1.systemd import service_restart, service_enable, service_running
-from jinja2 import Environment, FileSystemLoader
+import sys
+import tempfile
+from dataclasses import dataclass, field
+from typing import TYPE_CHECKING
+
+from charms.operator_libs_linux.v1.systemd import (
+    SystemdError,
+    service_enable,
+    service_restart,
+    service_running,
+    service_start,
+)
+
+# jinja2 and charmlibs.apt are imported where they are used, so that
+# importing this module (as charm.py always does) stays cheap
+if TYPE_CHECKING:
+    from jinja2 import Template
 
 logger = logging.getLogger(__name__)
 
+SERVICE_NAME = "isc-stork-server"
+SERVICE_WANTS_PATH = f"/etc/systemd/system/multi-user.target.wants/{SERVICE_NAME}.service"
+SERVER_ENV_PATH = "/etc/stork/server.env"
+SETUP_SCRIPT_URL = "https://dl.cloudsmith.io/public/isc/stork/cfg/setup/bash.deb.sh"
+
+_DBOPTS = (
+    "connect_timeout=5 keepalives=1 keepalives_idle=30 keepalives_count=1 tcp_user_timeout=30"
+)
+
+
+@dataclass(frozen=True, slots=True)
+class DbConn:
+    """Connection parameters for the PostgreSQL database."""
+
+    dbname: str
+    dbuser: str
+    dbhost: str
+    # Kept out of repr() so logging a connection does not leak it
+    dbpass: str = field(repr=False)
+    dbport: str
+    dbopts: str = _DBOPTS
+
+
+@functools.lru_cache(maxsize=1)
+def _get_template() -> "Template":
+    """Return the compiled server.env template, built once per process."""
+    from jinja2 import Environment, FileSystemLoader
+
+    env = Environment(loader=FileSystemLoader("templates"),
+            keep_trailing_newline=True, trim_blocks=False,
+            auto_reload=False)
+    return env.get_template("server.env.j2")
+
 
 def install() -> None:
     """Install the workload (by installing a snap, for example)."""
-    # You'll need to implement this function.
-    cmd = (
-        "curl -1sLf https://dl.cloudsmith.io/public/isc/stork/cfg/setup/bash.deb.sh"
-        "| sudo bash"
-    )
+    from charmlibs import apt
+
     try:
-        subprocess.run(cmd, shell=True, check=True)
-        apt.add_package(["isc-stork-server"])
+        # Fetch the repository setup script to a file and run it directly,
+        # hooks already run as root so no shell pipeline or sudo is needed
+        with tempfile.NamedTemporaryFile(prefix="stork-setup.", suffix=".sh") as script:
+            subprocess.run(["curl", "-1sLfo", script.name, SETUP_SCRIPT_URL],
+                check=True, timeout=30)
+            subprocess.run(["bash", script.name], check=True, timeout=300)
+        # The setup script has just refreshed the apt cache
+        apt.add_package(["isc-stork-server"], update_cache=False)
+        # A version read before installing would be stale now
+        get_version.cache_clear()
     except Exception as e:
         # Throw an error to ensure automatic retry later
         logger.error(f"Error installing stork: {str(e)}")
@@ -37,8 +90,12 @@ def start() -> None:
     # We do not start isc-stork-server here, we let systemd handle it
     # once the configuration is rendered.
 
+@functools.lru_cache(maxsize=1)
 def get_version() -> str | None:
-    """Get the running version of the workload."""
+    """Get the running version of the workload.
+
+    Cached for the lifetime of the process, which for a charm is one hook.
+    """
     # If we can't get the version, it is assumed the software isn't installed
     try:
         cmd = ["stork-server", "--version"]
@@ -57,44 +114,108 @@ def get_status() -> str:
 
 def is_running() -> bool:
     """Let systemd determine if the service is running"""
-    return service_running("isc-stork-server")
+    return service_running(SERVICE_NAME)
 
-def db_init(dbconn) -> int:
+def db_init(dbconn: DbConn) -> int:
     """Initialize the database"""
     logger.debug(f": {dbconn}")
 
     dbinit = ["stork-tool", "db-init",
-        f"--db-host={dbconn["dbhost"]}",
-        f"--db-name={dbconn["dbname"]}",
-        f"--db-user={dbconn["dbuser"]}",
-        f"--db-password={dbconn["dbpass"]}"]
+        f"--db-host={dbconn.dbhost}",
+        f"--db-name={dbconn.dbname}",
+        f"--db-user={dbconn.dbuser}"]
+    # Pass the password in the environment rather than on the command line,
+    # where it would be visible in the process table
+    env = dict(os.environ, STORK_DATABASE_PASSWORD=dbconn.dbpass)
+    # Only keep the stdout of stork-tool if it is going to be logged
+    stdout = subprocess.PIPE if logger.isEnabledFor(logging.DEBUG) else subprocess.DEVNULL
 
     try:
-        sp = subprocess.run(dbinit, check=False, capture_output=True, encoding="utf-8")
-        logger.info(f"Database creation result: {sp}")
+        sp = subprocess.run(dbinit, check=False, env=env, stdout=stdout,
+            stderr=subprocess.PIPE, timeout=60)
     except Exception as e:
         # Throw an error to ensure automatic retry later
         logger.error(f"Error initializing database: {str(e)}")
         sys.exit(1)
 
-    return 0
+    if sp.stdout:
+        logger.debug("stork.db_init(): stork-tool output: %s", sp.stdout.decode(errors="replace"))
+    if sp.returncode != 0:
+        logger.error("stork.db_init(): stork-tool failed with exit code %d: %s",
+            sp.returncode, sp.stderr.decode(errors="replace").rstrip())
+    else:
+        logger.info("stork.db_init(): Database initialized")
 
-def render_and_reload(dbconn) -> int:
-    # TODO: This should later only reload on actual config change
-    env = Environment(loader=FileSystemLoader("templates"),
-            keep_trailing_newline=True, trim_blocks=False)
-    stork_server_env_tmpl = env.get_template("server.env.j2")
-    
+    return sp.returncode
+
+def _write_if_changed(path: str, content: bytes) -> bool:
+    """Atomically write content to path, returns False if it was already there."""
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        st = None
+
+    if st is not None and st.st_size == len(content):
+        with open(path, "rb") as file:
+            if file.read() == content:
+                return False
+
+    # Write next to the target so os.replace() stays on the same filesystem
+    fd, tmppath = tempfile.mkstemp(dir=os.path.dirname(path),
+        prefix=f".{os.path.basename(path)}.")
+    try:
+        try:
+            file = os.fdopen(fd, "wb")
+        except BaseException:
+            os.close(fd)
+            raise
+        with file:
+            file.write(content)
+        # Keep the ownership and mode of the file we replace (the package ships it),
+        # a new file keeps the 0600 from mkstemp() as it holds the DB password
+        if st is not None:
+            os.chown(tmppath, st.st_uid, st.st_gid)
+            os.chmod(tmppath, st.st_mode & 0o7777)
+        os.replace(tmppath, path)
+    except BaseException:
+        os.unlink(tmppath)
+        raise
+
+    return True
+
+def render_and_reload(dbconn: DbConn) -> int:
     # TODO: If we have no postgres relation, we must do something here
-    stork_server_env = stork_server_env_tmpl.render(
-        dbhost=dbconn["dbhost"],
-        dbname=dbconn["dbname"],
-        dbuser=dbconn["dbuser"],
-        dbpass=dbconn["dbpass"],
+    stork_server_env = _get_template().render(
+        dbhost=dbconn.dbhost,
+        dbname=dbconn.dbname,
+        dbuser=dbconn.dbuser,
+        dbpass=dbconn.dbpass,
     )
-    with open("/etc/stork/server.env", "w") as file:
-        file.write(stork_server_env)
+    changed = _write_if_changed(SERVER_ENV_PATH, stork_server_env.encode())
 
-    # reload/restart in some way here
-    service_enable("isc-stork-server")
-    service_restart("isc-stork-server")
+    try:
+        # Enabling is only needed once, after that the unit is wanted by multi-user.target.
+        # Checked on every render, the service may have been started without being enabled.
+        if not os.path.exists(SERVICE_WANTS_PATH):
+            service_enable(SERVICE_NAME)
+
+        running = service_running(SERVICE_NAME)
+        if not changed and running:
+            logger.info("stork.render_and_reload(): server.env unchanged, not restarting")
+            return 0
+
+        # Also start when unchanged, a failed start in an earlier hook is retried this way
+        if not running:
+            ok = service_start(SERVICE_NAME)
+        else:
+            # The env file is only read when the service starts, a reload would not pick it up
+            ok = service_restart(SERVICE_NAME)
+    except SystemdError as e:
+        logger.error("stork.render_and_reload(): %s", e)
+        return 1
+
+    if not ok:
+        logger.error("stork.render_and_reload(): Failed to (re)start %s", SERVICE_NAME)
+        return 1
+
+    return 0
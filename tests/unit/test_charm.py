@@ -6,6 +6,7 @@
 import pytest
 from ops import testing
 
+import stork
 from charm import StorkCharm
 
 
@@ -14,13 +15,134 @@ def mock_get_version():
     return "1.0.0"
 
 
+def database_relation(**kwargs) -> testing.Relation:
+    """Get a database relation with complete data, overridden (or dropped if None) by kwargs."""
+    data = {
+        "database": "stork_database",
+        "username": "stork",
+        "password": "secret",
+        "endpoints": "10.0.0.1:5432",
+    }
+    data.update(kwargs)
+    data = {key: value for key, value in data.items() if value is not None}
+    return testing.Relation("database", remote_app_data=data)
+
+
+@pytest.fixture
+def rendered(monkeypatch: pytest.MonkeyPatch) -> list[stork.DbConn]:
+    """Mock the workload, returns the connections render_and_reload() was called with."""
+    calls: list[stork.DbConn] = []
+    monkeypatch.setattr("charm.stork.get_version", mock_get_version)
+    monkeypatch.setattr("charm.stork.is_running", lambda: True)
+    monkeypatch.setattr("charm.stork.render_and_reload", lambda dbconn: calls.append(dbconn))
+    return calls
+
+
 def test_start(monkeypatch: pytest.MonkeyPatch):
     """Test that the charm has the correct state after handling the start event."""
     # Arrange:
     ctx = testing.Context(StorkCharm)
     monkeypatch.setattr("charm.stork.get_version", mock_get_version)
+    monkeypatch.setattr("charm.stork.is_running", lambda: True)
+    monkeypatch.setattr("charm.stork.get_status", lambda: "")
     # Act:
-    state_out = ctx.run(ctx.on.start(), testing.State())
+    state_out = ctx.run(ctx.on.start(), testing.State(relations={database_relation()}))
     # Assert:
     assert state_out.workload_version is not None
     assert state_out.unit_status == testing.ActiveStatus()
+
+
+def test_start_without_database(monkeypatch: pytest.MonkeyPatch):
+    """Test that the charm is blocked on start without a database relation."""
+    ctx = testing.Context(StorkCharm)
+    monkeypatch.setattr("charm.stork.get_version", mock_get_version)
+    state_out = ctx.run(ctx.on.start(), testing.State())
+    assert state_out.unit_status == testing.BlockedStatus("database relation missing")
+
+
+def test_config_changed_with_database(rendered: list[stork.DbConn]):
+    """Test that config-changed renders the config from the database relation."""
+    ctx = testing.Context(StorkCharm)
+    state_out = ctx.run(ctx.on.config_changed(), testing.State(relations={database_relation()}))
+    assert rendered == [
+        stork.DbConn(
+            dbname="stork_database",
+            dbuser="stork",
+            dbhost="10.0.0.1",
+            dbpass="secret",
+            dbport="5432",
+        )
+    ]
+    assert state_out.workload_version == "1.0.0"
+    assert isinstance(state_out.unit_status, testing.ActiveStatus)
+
+
+@pytest.mark.parametrize("endpoints", ["10.0.0.1", "10.0.0.1:", "None:5432", "h1:1,h2:2"])
+def test_config_changed_invalid_endpoints(rendered: list[stork.DbConn], endpoints: str):
+    """Test that endpoints which are not host:port are rejected."""
+    ctx = testing.Context(StorkCharm)
+    relation = database_relation(endpoints=endpoints)
+    state_out = ctx.run(ctx.on.config_changed(), testing.State(relations={relation}))
+    assert rendered == []
+    assert state_out.unit_status == testing.BlockedStatus(
+        "database relation incomplete, check the logs"
+    )
+
+
+def test_database_created_init_failure(
+    monkeypatch: pytest.MonkeyPatch, rendered: list[stork.DbConn]
+):
+    """Test that the config is not rendered when the database fails to initialize."""
+    ctx = testing.Context(StorkCharm)
+    monkeypatch.setattr("charm.stork.db_init", lambda dbconn: 1)
+    relation = database_relation()
+    state_out = ctx.run(ctx.on.relation_changed(relation, remote_unit=0),
+        testing.State(relations={relation}))
+    assert rendered == []
+    assert [event.name for event in state_out.deferred] == ["database_created"]
+
+
+def test_config_changed_without_database_name(rendered: list[stork.DbConn]):
+    """Test that relation data without a database name is incomplete."""
+    ctx = testing.Context(StorkCharm)
+    relation = database_relation(database=None)
+    state_out = ctx.run(ctx.on.config_changed(), testing.State(relations={relation}))
+    assert rendered == []
+    assert state_out.unit_status == testing.BlockedStatus(
+        "database relation incomplete, check the logs"
+    )
+
+
+def test_incomplete_data_does_not_log_password(
+    rendered: list[stork.DbConn], caplog: pytest.LogCaptureFixture
+):
+    """Test that the incomplete relation data warning does not log the password."""
+    ctx = testing.Context(StorkCharm)
+    relation = database_relation(database=None)
+    ctx.run(ctx.on.config_changed(), testing.State(relations={relation}))
+    assert "password set=True" in caplog.text
+    assert "secret" not in caplog.text
+
+
+def test_config_changed_restart_failure(monkeypatch: pytest.MonkeyPatch):
+    """Test that config-changed is deferred when the service fails to (re)start."""
+    ctx = testing.Context(StorkCharm)
+    monkeypatch.setattr("charm.stork.get_version", mock_get_version)
+    monkeypatch.setattr("charm.stork.is_running", lambda: False)
+    monkeypatch.setattr("charm.stork.render_and_reload", lambda dbconn: 1)
+    state_out = ctx.run(ctx.on.config_changed(), testing.State(relations={database_relation()}))
+    assert [event.name for event in state_out.deferred] == ["config_changed"]
+    assert state_out.unit_status == testing.BlockedStatus("isc-stork-server is not running")
+
+
+def test_database_created_restart_failure(monkeypatch: pytest.MonkeyPatch):
+    """Test that database_created is deferred when the service fails to (re)start."""
+    ctx = testing.Context(StorkCharm)
+    monkeypatch.setattr("charm.stork.get_version", mock_get_version)
+    monkeypatch.setattr("charm.stork.is_running", lambda: False)
+    monkeypatch.setattr("charm.stork.db_init", lambda dbconn: 0)
+    monkeypatch.setattr("charm.stork.render_and_reload", lambda dbconn: 1)
+    relation = database_relation()
+    state_out = ctx.run(ctx.on.relation_changed(relation, remote_unit=0),
+        testing.State(relations={relation}))
+    assert [event.name for event in state_out.deferred] == ["database_created"]
@@ -0,0 +1,195 @@
+# Copyright 2026 Johan Hallbäck
+# See LICENSE file for licensing details.
+#
+# To learn more about testing, see https://documentation.ubuntu.com/ops/latest/explanation/testing/
+
+import os
+import pathlib
+import stat
+import subprocess
+
+import pytest
+
+import stork
+
+
+def make_dbconn(**kwargs) -> stork.DbConn:
+    """Build a connection with test values, overridden by kwargs."""
+    values = {
+        "dbname": "stork_database",
+        "dbuser": "stork",
+        "dbhost": "10.0.0.1",
+        "dbpass": "secret",
+        "dbport": "5432",
+    }
+    values.update(kwargs)
+    return stork.DbConn(**values)
+
+
+@pytest.fixture
+def systemd(monkeypatch: pytest.MonkeyPatch, tmp_path: pathlib.Path) -> list[str]:
+    """Fake the systemd helpers used by stork, returns the list of calls made."""
+    calls: list[str] = []
+    running = False
+    wants = tmp_path / "isc-stork-server.service"
+
+    def fake_running(name: str) -> bool:
+        return running
+
+    def fake_enable(name: str) -> bool:
+        calls.append("enable")
+        wants.touch()
+        return True
+
+    def fake_start(name: str) -> bool:
+        nonlocal running
+        calls.append("start")
+        running = True
+        return True
+
+    def fake_restart(name: str) -> bool:
+        calls.append("restart")
+        return True
+
+    monkeypatch.setattr("stork.SERVER_ENV_PATH", str(tmp_path / "server.env"))
+    monkeypatch.setattr("stork.SERVICE_WANTS_PATH", str(wants))
+    monkeypatch.setattr("stork.service_running", fake_running)
+    monkeypatch.setattr("stork.service_enable", fake_enable)
+    monkeypatch.setattr("stork.service_start", fake_start)
+    monkeypatch.setattr("stork.service_restart", fake_restart)
+    return calls
+
+
+def test_write_if_changed_missing_file(tmp_path: pathlib.Path):
+    """A new file is written with a private mode, it holds the DB password."""
+    path = tmp_path / "server.env"
+    assert stork._write_if_changed(str(path), b"a=1\n")
+    assert path.read_bytes() == b"a=1\n"
+    assert stat.S_IMODE(path.stat().st_mode) == 0o600
+
+
+def test_write_if_changed_unchanged(tmp_path: pathlib.Path):
+    """Identical content is not rewritten."""
+    path = tmp_path / "server.env"
+    path.write_bytes(b"a=1\n")
+    inode = path.stat().st_ino
+    assert not stork._write_if_changed(str(path), b"a=1\n")
+    assert path.stat().st_ino == inode
+
+
+def test_write_if_changed_same_size(tmp_path: pathlib.Path):
+    """Content of the same size but different bytes is written."""
+    path = tmp_path / "server.env"
+    path.write_bytes(b"a=1\n")
+    assert stork._write_if_changed(str(path), b"a=2\n")
+    assert path.read_bytes() == b"a=2\n"
+
+
+def test_write_if_changed_keeps_owner_and_mode(
+    monkeypatch: pytest.MonkeyPatch, tmp_path: pathlib.Path
+):
+    """Replacing a file keeps its ownership and mode."""
+    path = tmp_path / "server.env"
+    path.write_bytes(b"a=1\n")
+    path.chmod(0o640)
+    st = path.stat()
+    chowns = []
+    monkeypatch.setattr("stork.os.chown", lambda p, uid, gid: chowns.append((uid, gid)))
+    assert stork._write_if_changed(str(path), b"a=22\n")
+    assert chowns == [(st.st_uid, st.st_gid)]
+    assert stat.S_IMODE(path.stat().st_mode) == 0o640
+    # No temporary files are left behind
+    assert os.listdir(tmp_path) == ["server.env"]
+
+
+def test_render_and_reload(systemd: list[str]):
+    """The service is enabled and started once, then only restarted on changes."""
+    assert stork.render_and_reload(make_dbconn()) == 0
+    assert systemd == ["enable", "start"]
+
+    systemd.clear()
+    assert stork.render_and_reload(make_dbconn()) == 0
+    assert systemd == []
+
+    assert stork.render_and_reload(make_dbconn(dbhost="10.0.0.2")) == 0
+    assert systemd == ["restart"]
+    assert "STORK_DATABASE_HOST=10.0.0.2\n" in pathlib.Path(stork.SERVER_ENV_PATH).read_text()
+
+
+def test_db_init_password_in_env(monkeypatch: pytest.MonkeyPatch):
+    """The password is passed to stork-tool in the environment, not in argv."""
+    runs = []
+
+    def fake_run(args, **kwargs):
+        runs.append((args, kwargs))
+        return subprocess.CompletedProcess(args, 0, stdout=None, stderr=b"")
+
+    monkeypatch.setattr("stork.subprocess.run", fake_run)
+    assert stork.db_init(make_dbconn()) == 0
+    [(args, kwargs)] = runs
+    assert not any("secret" in arg for arg in args)
+    assert kwargs["env"]["STORK_DATABASE_PASSWORD"] == "secret"
+    assert kwargs["timeout"] == 60
+
+
+def test_db_init_failure(monkeypatch: pytest.MonkeyPatch):
+    """A failing stork-tool is reported through the return value."""
+
+    def fake_run(args, **kwargs):
+        return subprocess.CompletedProcess(args, 1, stdout=None, stderr=b"no such database\n")
+
+    monkeypatch.setattr("stork.subprocess.run", fake_run)
+    assert stork.db_init(make_dbconn()) == 1
+
+
+def test_render_and_reload_enables_running_service(systemd: list[str]):
+    """A running service that was disabled is enabled again, without a restart."""
+    stork.render_and_reload(make_dbconn())
+    os.unlink(stork.SERVICE_WANTS_PATH)
+    systemd.clear()
+    assert stork.render_and_reload(make_dbconn()) == 0
+    assert systemd == ["enable"]
+
+
+def test_render_and_reload_start_failure(monkeypatch: pytest.MonkeyPatch, systemd: list[str]):
+    """A failure to start the service is reported through the return value."""
+
+    def fake_start(name: str) -> bool:
+        raise stork.SystemdError("start failed")
+
+    monkeypatch.setattr("stork.service_start", fake_start)
+    assert stork.render_and_reload(make_dbconn()) == 1
+
+    monkeypatch.setattr("stork.service_start", lambda name: False)
+    assert stork.render_and_reload(make_dbconn()) == 1
+
+
+def test_write_if_changed_cleans_up(monkeypatch: pytest.MonkeyPatch, tmp_path: pathlib.Path):
+    """A failed write closes the temporary file and removes it."""
+    closed = []
+    real_close = os.close
+
+    def fake_fdopen(fd, mode):
+        raise OSError("fdopen failed")
+
+    def fake_close(fd):
+        closed.append(fd)
+        real_close(fd)
+
+    monkeypatch.setattr("stork.os.fdopen", fake_fdopen)
+    monkeypatch.setattr("stork.os.close", fake_close)
+    with pytest.raises(OSError):
+        stork._write_if_changed(str(tmp_path / "server.env"), b"a=1\n")
+    assert len(closed) == 1
+    assert os.listdir(tmp_path) == []
+
+
+def test_render_and_reload_enable_failure(monkeypatch: pytest.MonkeyPatch, systemd: list[str]):
+    """A failure to enable the service is reported like a start failure."""
+
+    def fake_enable(name: str) -> bool:
+        raise stork.SystemdError("enable failed")
+
+    monkeypatch.setattr("stork.service_enable", fake_enable)
+    assert stork.render_and_reload(make_dbconn()) == 1
+    assert systemd == []